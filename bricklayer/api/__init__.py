@@ -18,29 +18,46 @@ import pathlib
 import random
 import datetime
 import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
 from databricks_cli.workspace.api import WorkspaceApi
 from databricks_cli.jobs.api import JobsApi
 from databricks_cli.sdk import ApiClient
-from databricks_cli.sdk import JobsService
 from databricks_cli.clusters.api import ClusterApi
 from databricks_cli.runs.api import RunsApi
 
 from .. import get_notebook_context
 
+TERMINAL_LIFE_CYCLE_STATES = {'TERMINATED', 'SKIPPED', 'INTERNAL_ERROR'}
+
 class DBJobRun(object):
     '''Wrapper for a Job Run'''
 
-    def __init__(self, job, run_id, client):
+    def __init__(self, job, run_id, client, ttl=2.0):
+        """
+        :param ttl: Seconds a fetched run state is reused before the API is queried again
+        """
         self.job = job
         self.run_id = run_id
         self._client = client
+        self._runs_api = RunsApi(client)
+        self._ttl = ttl
+        self._cache = (None, 0.0)
 
     @property
     def data(self):
-        '''Return the data from the raw API call'''
-        return RunsApi(self._client).get_run(self.run_id)
+        '''Return the data from the raw API call, cached for `ttl` seconds'''
+        data, fetched_at = self._cache
+        if data is None or time.monotonic() - fetched_at >= self._ttl:
+            data = self._runs_api.get_run(self.run_id)
+            self._cache = (data, time.monotonic())
+        return data
+
+    def refresh(self):
+        '''Discard the cached run data so the next access queries the API'''
+        self._cache = (None, 0.0)
 
     @property
     def result_state(self):
@@ -64,10 +81,34 @@ class DBJobRun(object):
     def attempt_number(self):
         return self.data['attempt_number']
 
+    def wait(self, timeout=None, initial=1.0, max_interval=30.0, factor=2.0):
+        """Block until the run reaches a terminal state and return its result_state.
+        The API is polled with exponential backoff plus a small random jitter.
+        :param timeout: Max seconds to wait, None to wait forever. Raises TimeoutError when exceeded
+        :param initial: Seconds to sleep after the first poll
+        :param max_interval: Upper bound in seconds for the sleep between polls
+        :param factor: Multiplier applied to the sleep after each poll
+        """
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            self.refresh()
+            if self.life_cycle_state in TERMINAL_LIFE_CYCLE_STATES:
+                return self.result_state
+            interval = min(max_interval, initial * factor ** attempt)
+            interval += random.uniform(0, interval * 0.1)
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - started_at)
+                if remaining <= 0:
+                    raise TimeoutError(f'Run {self.run_id} not finished after {timeout} seconds')
+                interval = min(interval, remaining)
+            time.sleep(interval)
+            attempt += 1
+
     def get_run_output(self):
         '''Return the output of the job as defined in the
         job notebook with a call to `dbutils.notebook.exit` function'''
-        data = RunsApi(self._client).get_run_output(self.run_id)
+        data = self._runs_api.get_run_output(self.run_id)
         return data.get('notebook_output')
 
 class DBJob(object):
@@ -75,12 +116,13 @@ class DBJob(object):
     def __init__(self, job_id, client):
         self.job_id = job_id
         self._client = client
+        self._jobs_api = JobsApi(client)
         self.runs = []
 
     @property
     def data(self):
         '''Return the data from the raw JobApi call'''
-        return JobsApi(self._client).get_job(self.job_id)
+        return self._jobs_api.get_job(self.job_id)
 
     @property
     def name(self):
@@ -98,29 +140,54 @@ class DBJob(object):
         return self.data['settings']['existing_cluster_id']
 
     def run_now(self, jar_params=None, notebook_params=None, python_params=None,
-                    spark_submit_params=None):
+                    spark_submit_params=None, ttl=2.0):
         """Run this job.
         :param jar_params: list of jars to be included
         :param notebook_params: map (dict) with the params to be passed to the job
         :param python_params: To pa passed to the notebook as if they were command-line parameters
         :param spark_submit_params: A list of parameters for jobs with spark submit task as command-line
                             parameters.
+        :param ttl: Seconds the state of the returned run is cached before the API is queried again
         """
-        data = JobsApi(self._client).run_now(
+        data = self._jobs_api.run_now(
             self.job_id,
             jar_params=jar_params,
             notebook_params=notebook_params,
             python_params=python_params,
             spark_submit_params=spark_submit_params
         )
-        run = DBJobRun(self, data['run_id'], self._client)
+        run = DBJobRun(self, data['run_id'], self._client, ttl=ttl)
         self.runs.append(run)
         return run
 
+    def refresh_runs(self, limit=150):
+        """Refresh the state of all the runs of this job with paginated `runs/list`
+        calls instead of one `runs/get` call per run.
+        :param limit: Number of runs requested per page
+        """
+        pending = {run.run_id: run for run in self.runs}
+        offset = 0
+        while pending:
+            data = self._client.perform_query(
+                'GET', '/jobs/runs/list', data={
+                    "job_id": self.job_id,
+                    "offset": offset,
+                    "limit": limit
+                }
+            )
+            fetched_at = time.monotonic()
+            for run_data in data.get('runs', []):
+                run = pending.pop(run_data['run_id'], None)
+                if run is not None:
+                    run._cache = (run_data, fetched_at)
+            if not data.get('has_more'):
+                break
+            offset += limit
+
     def stop(self):
         "Stop this job."
         for run in self.runs:
-            JobsService(self._client).client.perform_query(
+            self._client.perform_query(
                 'POST', '/jobs/runs/cancel', data={
                     "run_id": run.run_id
                 }
@@ -146,11 +213,24 @@ class DBSApi(object):
                             api_version=api_version,
                             token=token
                             )
+        # ApiClient already keeps a requests.Session alive, widen its pool so
+        # concurrent calls reuse connections instead of opening new ones.
+        # The adapter class is kept so its TLS settings are preserved
+        adapter = self._client.session.get_adapter('https://')
+        self._client.session.mount('https://', type(adapter)(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=adapter.max_retries
+        ))
+        self._workspace_api = WorkspaceApi(self._client)
+        self._jobs_api = JobsApi(self._client)
+        self._cluster_api = ClusterApi(self._client)
+        self._known_dirs = set()
 
     def export_notebook(self, source_path, target_path, fmt='DBC', is_overwrite=False):
         "Export a notebook to a local file"
         (
-            WorkspaceApi(self._client)
+            self._workspace_api
             .export_workspace(
                 source_path,
                 target_path,
@@ -162,7 +242,7 @@ class DBSApi(object):
     def import_notebook(self, source_path, target_path, language='PYTHON', fmt='DBC', is_overwrite=False):
         "Import a notebook from a local file"
         (
-            WorkspaceApi(self._client)
+            self._workspace_api
             .import_workspace(
                 source_path,
                 target_path,
@@ -175,7 +255,7 @@ class DBSApi(object):
     def mkdir(self, dir_path):
         "Create a dir in the workspace"
         (
-            WorkspaceApi(self._client)
+            self._workspace_api
             .mkdirs(
                 dir_path
             )
@@ -183,13 +263,41 @@ class DBSApi(object):
 
     def backup_notebook(self, source_path, target_path, tmp_dir, fmt="DBC"):
         "Backup a notebook to another place in the workspace"
-        tmp_name = f'backup_{random.randint(0,1000)}'
+        tmp_name = f'backup_{uuid.uuid4().hex}'
         intermediate_location = pathlib.Path(tmp_dir).joinpath(tmp_name)
-        self.export_notebook(source_path, intermediate_location.as_posix(), fmt)
         try:
+            self.export_notebook(source_path, intermediate_location.as_posix(), fmt)
             self.import_notebook(intermediate_location, target_path, fmt)
         finally:
-            intermediate_location.unlink()
+            intermediate_location.unlink(missing_ok=True)
+
+    def backup_notebooks(self, pairs, tmp_dir, fmt="DBC", max_workers=8):
+        """Backup several notebooks concurrently.
+        :param pairs: list of (source_path, target_path) tuples
+        :param tmp_dir: Local dir used for the intermediate exported files
+        :param max_workers: Max number of backups running at the same time, keep it low
+                            to stay under the workspace API rate limits
+        Raises a RuntimeError listing every pair that failed once all the backups are done.
+        """
+        failures = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.backup_notebook, source_path, target_path, tmp_dir, fmt):
+                    (source_path, target_path)
+                for source_path, target_path in pairs
+            }
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    failures.append((futures[future], error))
+        if failures:
+            details = '\n'.join(
+                f'{source_path} -> {target_path}: {error!r}'
+                for (source_path, target_path), error in failures
+            )
+            raise RuntimeError(
+                f'{len(failures)} notebook backups failed:\n{details}'
+            ) from failures[0][1]
 
     def export_current_notebook_run(self, target_path, tmp_dir, fmt="DBC"):
         """Save the current notebook to a given location in the required format (default DBC)
@@ -207,15 +315,11 @@ class DBSApi(object):
                 .joinpath(current_path[1:])
                 .joinpath(timestamp)
         )
-        try:
-            self.backup_notebook(current_path, target_path.as_posix(), tmp_dir, fmt)
-        except requests.exceptions.HTTPError as _e:
-            error_code = _e.response.json()['error_code']
-            if error_code == 'RESOURCE_DOES_NOT_EXIST':
-                self.mkdir(target_path.parent.as_posix())
-                self.backup_notebook(current_path, target_path.as_posix(), fmt)
-            else:
-                raise
+        parent_path = target_path.parent.as_posix()
+        if parent_path not in self._known_dirs:
+            self.mkdir(parent_path)
+            self._known_dirs.add(parent_path)
+        self.backup_notebook(current_path, target_path.as_posix(), tmp_dir, fmt)
 
     def create_job(self, notebook_path, job_name=None, cluster_name=None,
             cluster_id=None, notifications_email=None):
@@ -261,7 +365,7 @@ class DBSApi(object):
         """
         if cluster_name:
             assert cluster_id is None
-            _cluster_id = ClusterApi(self._client).get_cluster_id_for_name(cluster_name)
+            _cluster_id = self._cluster_api.get_cluster_id_for_name(cluster_name)
         elif cluster_id:
             _cluster_id = cluster_id
         else:
@@ -299,7 +403,7 @@ class DBSApi(object):
                     }
                 }
             )
-        jobdata = JobsApi(self._client).create_job(_json)
+        jobdata = self._jobs_api.create_job(_json)
         return DBJob(
             jobdata['job_id'],
             self._client
@@ -309,7 +413,7 @@ class DBSApi(object):
         """List all jobs with job name or job id
         """
         jobs = []
-        _jobs = JobsApi(self._client).list_jobs()['jobs']
+        _jobs = self._jobs_api.list_jobs()['jobs']
 
         if job_name:
             result = list(
@@ -341,5 +445,5 @@ class DBSApi(object):
         """delete the created job based on job_id
         """
         if job_id is not None:
-            JobsApi(self._client).delete_job(job_id)
+            self._jobs_api.delete_job(job_id)
         
\ No newline at end of file
@@ -1,23 +1,35 @@
 ''' Module to display a folium map in databricks notebooks'''
+import html
 import math
+import re
 
-import pyspark
-from pyspark.sql import SparkSession
-
+import numpy as np
 import pandas as pd
 import folium
 from folium.plugins import HeatMap
 
-import shapely.wkt as wkt
+import shapely
 import shapely.geometry
 import shapely.geometry.base
 
+from ... import get_spark
+
+GEOMETRY_COL_PATTERN = re.compile('geom|geography|wkt')
+
+
+def reduce_bounds(bounds) -> tuple:
+    '''Reduce an (N, 4) array of minx, miny, maxx, maxy rows to the bounds containing all of them'''
+    bounds = np.asarray(bounds, dtype=float)
+    minx, miny = bounds[:, :2].min(axis=0)
+    maxx, maxy = bounds[:, 2:].max(axis=0)
+    return minx, miny, maxx, maxy
+
 
 class Layer():
     ''' Layer to be rendered in the map '''
 
     def __init__(self, data, geometry_col=None, popup_attrs=False, color='red',
-                    weight=None, radius=1):
+                    weight=None, radius=1, copy=False):
         """
             Args:
                 data (*): pandas dataframe, or a geodataframe or a spark dataframe or a databricks SQL query.
@@ -25,17 +37,19 @@ class Layer():
                 color (str): Color to render the layer. Color name or RGB. (i.e. '#3388ff')
                 weight (int): Width of the stroke when rendering lines or points. By default is 1.
                 radius (int): Radius of the circles used for points default is 1.
+                copy (bool): Copy a pandas dataframe passed as data, by default the layer shares its values.
 
             Returns:
                 folium.Map: Folium map to be rendered.
         """
-        dataframe = self.get_dataframe(data)
+        dataframe = self.get_dataframe(data, copy)
         if dataframe.empty:
             raise ValueError('No data to display')
         self.geometry_col = self.get_geometry_col(geometry_col, dataframe)
         self.dataframe = self.get_dataframe_with_geom(dataframe, self.geometry_col)
         self.centroid = self.get_centroid(self.dataframe, self.geometry_col)
         self.popup_attrs = popup_attrs
+        self._popup_cols = self.get_popup_cols()
         self.color = color
         self.weight = weight
         self.radius = radius
@@ -47,34 +61,59 @@ class Layer():
                 raise ValueError(f"Column {geometry_col} not found in data columns")
             return geometry_col
         else:
-            candidates = []
-            for column in dataframe.columns:
-                if 'geom' in column:
-                    candidates.append(column)
-                elif 'geography' in column:
-                    candidates.append(column)
-                elif 'wkt' in column:
-                    candidates.append(column)
+            candidates = [
+                column for column in dataframe.columns
+                if GEOMETRY_COL_PATTERN.search(str(column))
+            ]
+            if not candidates:
+                raise ValueError("No geometry column found, specify the geometry_col argument for the data")
             if len(candidates) > 1:
                 raise ValueError("Specify the geometry_col argument for the data")
             return candidates[0]
 
-    def get_dataframe(self, data)->pd.DataFrame:
+    def get_dataframe(self, data, copy=False)->pd.DataFrame:
         '''Get the data in a pandas DataFrame'''
         if isinstance(data, pd.DataFrame):
-            return data.copy()
-        if isinstance(data, pyspark.sql.dataframe.DataFrame):
-            return data.toPandas()
-        if isinstance(data, str):
-            spark = SparkSession.builder.getOrCreate()
-            return spark.sql(data).toPandas()
+            return data.copy() if copy else data
+        # pyspark is slow to import, only load it when the data is not already in pandas.
+        # Without pyspark installed no spark data or SQL query can be interpreted
+        try:
+            from pyspark.sql import DataFrame
+            spark_types = (DataFrame, str)
+        except ImportError:
+            spark_types = ()
+        if isinstance(data, spark_types):
+            if isinstance(data, str):
+                spark = get_spark()
+                data = spark.sql(data)
+            else:
+                spark = data.sparkSession
+            # Arrow moves the data to pandas in columnar batches instead of pickled rows,
+            # the session settings are restored afterwards
+            arrow_conf = [
+                'spark.sql.execution.arrow.pyspark.enabled',
+                'spark.sql.execution.arrow.pyspark.fallback.enabled'
+            ]
+            previous_conf = {key: spark.conf.get(key, None) for key in arrow_conf}
+            try:
+                for key in arrow_conf:
+                    spark.conf.set(key, 'true')
+                return data.toPandas()
+            finally:
+                for key, value in previous_conf.items():
+                    if value is None:
+                        spark.conf.unset(key)
+                    else:
+                        spark.conf.set(key, value)
         raise NotImplementedError(f"Can't interpret data with type {type(data)}")
 
     def get_dataframe_with_geom(self, dataframe: pd.DataFrame, geometry_col: str):
         '''Convert the geometry column to a shapely geometry'''
         geom = dataframe.iloc[0][geometry_col]
         if isinstance(geom, str):
-            dataframe[geometry_col] = dataframe[geometry_col].apply(wkt.loads)
+            # Shallow copy so the caller's dataframe keeps its WKT column
+            dataframe = dataframe.copy(deep=False)
+            dataframe[geometry_col] = shapely.from_wkt(dataframe[geometry_col].to_numpy())
             return dataframe
         if isinstance(geom, shapely.geometry.base.BaseGeometry):
             return dataframe
@@ -82,79 +121,83 @@ class Layer():
 
     def get_centroid(self, dataframe: pd.DataFrame, geometry_col: str):
         '''Get the centroid of all the geometries in the layer'''
-        centroids = [r.centroid for _, r in dataframe[geometry_col].items()]
-        multipoint = shapely.geometry.MultiPoint(centroids)
-        return multipoint.centroid
+        centroids = shapely.centroid(dataframe[geometry_col].to_numpy())
+        return shapely.multipoints(centroids).centroid
 
-    def get_popup(self, row: pd.Series):
-        '''Get a folium pop-up with the requested attributes'''
+    def get_popup_cols(self):
+        '''Get the columns to be shown in the pop-up'''
         if isinstance(self.popup_attrs, list):
-            non_geom_cols = self.popup_attrs
-        else:
-            non_geom_cols = list(self.dataframe.columns)
-            non_geom_cols.remove(self.geometry_col)
-
-        return folium.Popup((
-                row
-                [non_geom_cols]
-                .to_frame()
-                .to_html()
-        ))
-
-    def get_map_geom(self, row: pd.Series):
-        '''Get folium geometry from the shapely geom'''
-        sgeom = row[self.geometry_col]
-        kwargs = {'color': self.color}
+            return self.popup_attrs
+        return [c for c in self.dataframe.columns if c != self.geometry_col]
+
+    def get_properties(self, record: dict):
+        '''Get the JSON serializable GeoJSON properties of a feature from its pop-up attributes,
+        text is html escaped as the pop-up inserts it as html'''
+        properties = {}
+        for col, value in record.items():
+            if isinstance(value, np.generic):
+                value = value.item()
+            elif value is not None and not isinstance(value, (str, int, float, bool)):
+                value = str(value)
+            if isinstance(value, str):
+                value = html.escape(value)
+            properties[str(col)] = value
+        return properties
+
+    def get_feature_collection(self):
+        '''Get all the geometries of the layer as a GeoJSON FeatureCollection'''
+        geoms = self.dataframe[self.geometry_col].to_numpy()
         if self.popup_attrs:
-            html_popup = self.get_popup(row)
+            records = self.dataframe[self._popup_cols].to_dict('records')
         else:
-            html_popup = None
+            records = [{}] * len(geoms)
+        return {
+            'type': 'FeatureCollection',
+            'features': [
+                {
+                    'type': 'Feature',
+                    # an explicit id keeps folium from using a property as the feature identifier
+                    'id': str(i),
+                    'geometry': shapely.geometry.mapping(sgeom),
+                    'properties': self.get_properties(record)
+                }
+                for i, (sgeom, record) in enumerate(zip(geoms, records))
+            ]
+        }
+
+    def get_style(self, feature):
+        '''Get the leaflet style of a feature'''
+        style = {'color': self.color}
         if self.weight is not None:
-            kwargs['weight'] = self.weight
-        if isinstance(sgeom, shapely.geometry.LineString):
-            coords = [(y, x) for x,y in sgeom.coords]
-            fgeom = folium.PolyLine(
-                coords,
-                **kwargs
-            )
-        elif isinstance(sgeom, shapely.geometry.Point):
-            kwargs['radius'] = self.radius
-            coords = [(y, x) for x,y in sgeom.coords]
-            fgeom = folium.CircleMarker(
-                coords[0],
-                **kwargs
-            )
-        else:
-            raise NotImplementedError(f'Geometry Type not Supported {type(sgeom)}')
-        if html_popup:
-            fgeom.add_child(html_popup)
-        return fgeom
+            style['weight'] = self.weight
+        return style
 
     def get_bounds(self):
         '''Get the bounds for all the geometries'''
-        minx, miny, maxx, maxy = None, None, None, None
-        geoms_bounds = self.dataframe[self.geometry_col].apply(lambda g:g.bounds)
-        for _minx, _miny, _maxx, _maxy in geoms_bounds:
-            if minx is None:
-                minx, miny, maxx, maxy = _minx, _miny, _maxx, _maxy
-            else:
-                minx = min(minx, _minx)
-                miny = min(miny, _miny)
-                maxx = max(maxx, _maxx)
-                maxy = max(maxy, _maxy)
-        return minx, miny, maxx, maxy
+        return reduce_bounds(shapely.bounds(self.dataframe[self.geometry_col].to_numpy()))
 
     def render_to_map(self, folium_map):
         '''Render the layer into the map'''
-        for _, row in self.dataframe.iterrows():
-            map_geom = self.get_map_geom(row)
-            map_geom.add_to(folium_map)
+        if self.popup_attrs:
+            fields = [str(col) for col in self._popup_cols]
+            popup = folium.GeoJsonPopup(
+                fields=fields,
+                aliases=[html.escape(field) for field in fields]
+            )
+        else:
+            popup = None
+        folium.GeoJson(
+            self.get_feature_collection(),
+            style_function=self.get_style,
+            marker=folium.CircleMarker(radius=self.radius),
+            popup=popup
+        ).add_to(folium_map)
 
 
 class HeatMapLayer(Layer):
     '''Add a heat map layer to be rendered to the map'''
 
-    def __init__(self, data, name=None, geometry_col=None, radius=10, blur=10, min_opacity=1, gradient={0.4: 'blue', 0.65: 'lime', 1: 'red'}):
+    def __init__(self, data, name=None, geometry_col=None, radius=10, blur=10, min_opacity=1, gradient={0.4: 'blue', 0.65: 'lime', 1: 'red'}, copy=False):
         """
             Args:
                 data (*): pandas dataframe, or a geodataframe or a spark dataframe or a databricks SQL query.
@@ -163,11 +206,12 @@ class HeatMapLayer(Layer):
                 blur (int): Amount of blur in each point
                 min_opacity (int): The minimum opacity the heat will start at
                 gradient (dict): Color gradient config
+                copy (bool): Copy a pandas dataframe passed as data, by default the layer shares its values.
 
             Returns:
                 folium.Map: Folium map to be rendered.
         """
-        dataframe = Layer.get_dataframe(self, data)
+        dataframe = Layer.get_dataframe(self, data, copy)
         if dataframe.empty:
             raise ValueError('No data to display')
         self.geometry_col = Layer.get_geometry_col(self, geometry_col, dataframe)
@@ -218,17 +262,7 @@ class Map():
 
     def get_bounds(self):
         '''Get the bounds of all the layers'''
-        minx, miny, maxx, maxy = None, None, None, None
-        for layer in self.layers:
-            _minx, _miny, _maxx, _maxy = layer.get_bounds()
-            if minx is None:
-                minx, miny, maxx, maxy = _minx, _miny, _maxx,_maxy
-            else:
-                minx = min(minx, _minx)
-                miny = min(miny, _miny)
-                maxx = max(maxx, _maxx)
-                maxy = max(maxy, _maxy)
-        return minx, miny, maxx, maxy
+        return reduce_bounds([layer.get_bounds() for layer in self.layers])
 
     def render(self):
         '''Render the map'''
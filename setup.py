@@ -19,8 +19,8 @@ setuptools.setup(
         "Programming Language :: Python :: 3",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     install_requires=[
-        'databricks_cli', 'shapely', 'folium', 'pyyaml'
+        'databricks_cli', 'shapely>=2.0', 'folium>=0.14', 'pyyaml'
     ]
 )